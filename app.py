@@ -6,88 +6,371 @@ Avec interface d'édition des références et poids
 
 from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
 import pandas as pd
-import PyPDF2
+import openpyxl
+import pypdfium2 as pdfium
 import os
 import re
 from pathlib import Path
 from werkzeug.utils import secure_filename
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import json
+import orjson
+import copy
+from collections import OrderedDict
+import csv
+import hashlib
+import tempfile
+import threading
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
-app.config['EXCEL_FILE'] = 'uploads/Produits_référencés_EHS.xlsx'
+app.config['REFERENCES_FILE'] = 'uploads/Produits_référencés_EHS.parquet'
+app.config['EXCEL_FILE'] = 'uploads/Produits_référencés_EHS.xlsx'  # import initial uniquement
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config.from_prefixed_env()  # surcharges par variables FLASK_* (ex. FLASK_TESTING=true)
 
 # Créer les dossiers s'ils n'existent pas
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+# Expressions régulières de parsing, compilées une seule fois
+_RE_NUM = re.compile(r'#(LI\d+)')
+_RE_REF = re.compile(r'Réf\. de commande.*?\n\s*(\w+)')
+_RE_DATE = re.compile(r'LIVRAISON\s+(\d{2}/\d{2}/\d{4})')
+_RE_ADDR = re.compile(r'Adresse de livraison\s+(.*?)(?=Réf\. de commande|$)', re.DOTALL)
+_RE_PHONE = re.compile(r'0\d{9}')
+_RE_PHONE_ONLY = re.compile(r'^0\d{9}$')
+_RE_ORDER_ITEMS = re.compile(r'Référence\s+Produit\s+Qté\s+(?P<body>.*?)(?=Le destinataire|$)', re.DOTALL)
+# Ligne ouvrant un produit : référence Prozon en début de ligne
+_RE_ITEM_LINE = re.compile(r'(\d{5}-\d+)(?:\s+(.*)|$)')
+_RE_QTY = re.compile(r'(\d+)\s*$')
+
+# PDFium n'est pas thread-safe (même sur des documents distincts) : l'extraction du
+# texte est faite dans un pool de processus, jamais dans le processus de l'application
+_PDF_POOL_MAX_WORKERS = min(8, os.cpu_count() or 1)
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _extract_text(pdf: Union[str, bytes]) -> str:
+    """Extrait le texte brut d'un PDF avec PDFium (exécuté dans un processus du pool)"""
+    parts = []
+    pdf = pdfium.PdfDocument(pdf)
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range() or '')
+            # Libérer les ressources natives page par page
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    # PDFium renvoie des fins de ligne Windows
+    return '\n'.join(parts).replace('\r\n', '\n')
+
+
+def _submit_extraction(pdf: Union[str, bytes]) -> Future:
+    """Soumet une extraction au pool de processus (créé à la demande, recréé s'il est cassé)"""
+    global _pdf_pool
+    for attempt in range(2):
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                _pdf_pool = ProcessPoolExecutor(max_workers=_PDF_POOL_MAX_WORKERS)
+            pool = _pdf_pool
+        try:
+            return pool.submit(_extract_text, pdf)
+        except BrokenProcessPool:
+            # Un processus du pool est mort (PDF qui fait planter PDFium) : on repart d'un pool neuf
+            with _pdf_pool_lock:
+                if _pdf_pool is pool:
+                    _pdf_pool = None
+            if attempt:
+                raise
+
+
+# Cache disque des PDFs traités : incrémenter la version à chaque changement du parsing
+# ou de l'enrichissement, pour ne pas resservir d'anciens résultats
+_CACHE_VERSION = 2
+_CACHE_MAX_FILES = 500
+_MEMO_MAX_RESULTS = 64  # résultats gardés en mémoire par processeur (LRU)
+
+
+@dataclass
+class RefPayload:
+    """Données d'ajout / modification d'une référence reçues par l'API"""
+    ref_prozon: str
+    ref_ehs: str
+    nom_produit: str
+    poids: float
+    prix: Optional[float] = None
+    
+    def __post_init__(self):
+        self.poids = float(self.poids)
+        self.prix = float(self.prix) if self.prix else None
+
 
 class ProzonOrderProcessor:
-    def __init__(self, excel_path: str):
-        """Initialise le processeur avec le fichier Excel de correspondances"""
+    COLUMNS = ['Références Prozon', 'Noms des produits', 'Références EHS', 'Prix', 'poids']
+    CSV_FIELDS = [
+        'Numero_Commande', 'Ref_Commande', 'Date', 'Client', 'Adresse_Livraison', 'Ville',
+        'Telephone', 'Ref_Prozon', 'Ref_EHS', 'Quantite', 'Poids_Unitaire', 'Poids_Total', 'Statut'
+    ]
+    
+    def __init__(self, references_path: str, cache_dir: Optional[str] = None,
+                 excel_path: Optional[str] = None):
+        """Initialise le processeur avec le fichier Parquet de correspondances
+        
+        excel_path : ancien fichier Excel, importé si le fichier Parquet n'existe pas encore
+        """
+        self.cache_dir = cache_dir
+        self._results_lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._df = None
+        self._pending_rows: List[Dict] = []
+        self._pending_pos: Dict[str, int] = {}  # réf. Prozon -> position dans _pending_rows
+        self._row_of: Optional[Dict[str, int]] = None  # réf. Prozon -> ligne du DataFrame
+        self._records_cache: Optional[List[Dict]] = None
+        self.references_path = references_path
+        if os.path.exists(references_path):
+            df = pd.read_parquet(references_path)
+            df.columns = self._column_names(df.columns)
+            self.df = df
+            self._build_index()
+            self._mtime = os.stat(references_path).st_mtime_ns
+            print(f"✅ Chargé {len(self.df)} références depuis {Path(references_path).name}")
+        elif excel_path and os.path.exists(excel_path):
+            self._load_excel(excel_path)
+            self.save_references()
+            # Index reconstruit sur les valeurs normalisées, telles qu'elles seront relues
+            self._build_index()
+            print(f"✅ Importé {len(self._records)} références depuis {Path(excel_path).name}")
+        else:
+            # Créer un fichier de références vide si inexistant
+            self.df = pd.DataFrame(columns=self.COLUMNS)
+            self._build_index()
+            self.save_references()
+            print(f"✅ Fichier de références créé : {references_path}")
+    
+    def _load_excel(self, excel_path: str):
+        """Lit le fichier Excel en streaming (sans pandas) et construit l'index"""
+        wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
         try:
-            self.excel_path = excel_path
-            self.df = pd.read_excel(excel_path)
-            print(f"✅ Chargé {len(self.df)} références depuis {Path(excel_path).name}")
+            rows = wb.active.iter_rows(values_only=True)
+            header = self._column_names(next(rows, None) or self.COLUMNS)
+            missing = [c for c in self.COLUMNS if c not in header]
+            if missing:
+                raise ValueError(
+                    f"Colonnes manquantes dans {Path(excel_path).name} : {', '.join(missing)}"
+                )
+            self._columns = header
+            self._records = [row for row in rows if any(v is not None for v in row)]
+        finally:
+            wb.close()
+        
+        positions = [header.index(c) for c in
+                     ('Références Prozon', 'Références EHS', 'Noms des produits', 'poids', 'Prix')]
+        self._build_index(tuple(row[i] for i in positions) for row in self._records)
+    
+    @staticmethod
+    def _column_names(names) -> List[str]:
+        """Noms de colonnes en texte ; en-têtes vides nommés comme pandas ('Unnamed: 5')"""
+        return [
+            f'Unnamed: {i}' if name is None or (not isinstance(name, str) and pd.isna(name))
+            or not str(name).strip() else str(name)
+            for i, name in enumerate(names)
+        ]
+    
+    @property
+    def df(self) -> pd.DataFrame:
+        """DataFrame des références, construit à la demande"""
+        df = self._base_df()
+        if self._pending_rows:
+            # Intégrer en une seule fois les lignes ajoutées depuis le dernier accès
+            if self._row_of is not None:
+                for ref_prozon, pos in self._pending_pos.items():
+                    self._row_of.setdefault(ref_prozon, len(df) + pos)
+            self._df = pd.concat([df, pd.DataFrame(self._pending_rows)], ignore_index=True)
+            self._pending_rows.clear()
+            self._pending_pos.clear()
+        return self._df
+    
+    def _base_df(self) -> pd.DataFrame:
+        """DataFrame sans les lignes en attente (construit à la demande)"""
+        if self._df is None:
+            # dtype object : une colonne d'entiers avec des cases vides ne doit pas passer
+            # en float64 (40012 deviendrait '40012.0' une fois converti en texte)
+            self._df = pd.DataFrame(self._records, columns=self._columns, dtype=object)
+        return self._df
+    
+    def _row_position(self, ref_prozon: str) -> int:
+        """Ligne (hors lignes en attente) de la première occurrence d'une référence"""
+        if self._row_of is None:
+            self._row_of = {}
+            for pos, ref in enumerate(self._base_df()['Références Prozon']):
+                self._row_of.setdefault(ref, pos)
+        return self._row_of[ref_prozon]
+    
+    @df.setter
+    def df(self, value: pd.DataFrame):
+        self._df = value
+        self._row_of = None
+        self._records_cache = None
+    
+    def records(self) -> List[Dict]:
+        """Références sous forme de liste de dicts (valeurs manquantes à None), mise en cache"""
+        if self._records_cache is None:
+            df = self.df
+            self._records_cache = df.astype(object).where(df.notna(), None).to_dict('records')
+        return self._records_cache
+    
+    @staticmethod
+    def _index_entry(ref_ehs, nom, poids, prix) -> Dict:
+        """Correspondance EHS telle que renvoyée par convert_reference"""
+        def to_float(value):
+            # Même conversion qu'à la sauvegarde : l'empreinte de l'index reste stable
+            value = pd.to_numeric(value, errors='coerce')
+            return float(value) if pd.notna(value) else None
+        
+        def or_none(value):
+            # Case vide relue depuis Parquet : NaN, pas None
+            return None if not isinstance(value, str) and pd.isna(value) else value
+        
+        return {
+            'reference_ehs': or_none(ref_ehs),
+            'nom_produit': or_none(nom),
+            'poids_unitaire': to_float(poids),
+            'prix': to_float(prix)
+        }
+    
+    def _build_index(self, rows=None):
+        """Construit l'index des correspondances par référence Prozon
+        
+        rows : tuples (réf. Prozon, réf. EHS, nom, poids, prix) ; par défaut lus dans self.df
+        """
+        if rows is None:
+            columns = ['Références Prozon', 'Références EHS', 'Noms des produits', 'poids', 'Prix']
+            rows = self.df[columns].itertuples(index=False, name=None)
+        self._index: Dict[str, List[Dict]] = {}
+        for ref_prozon, ref_ehs, nom, poids, prix in rows:
+            self._index.setdefault(ref_prozon, []).append(
+                self._index_entry(ref_ehs, nom, poids, prix)
+            )
+        self._index_changed()
+    
+    def _index_changed(self):
+        """À appeler après toute modification de l'index"""
+        # Empreinte recalculée seulement quand une clé de cache en a besoin
+        self._index_hash = None
+        # Les résultats mémorisés avec l'ancienne empreinte ne resserviront plus
+        with self._results_lock:
+            self._results: 'OrderedDict[str, Dict]' = OrderedDict()
+    
+    @property
+    def index_hash(self) -> str:
+        """Empreinte des correspondances, pour invalider le cache des PDFs traités"""
+        if self._index_hash is None:
+            self._index_hash = hashlib.sha256(
+                json.dumps(self._index, default=str).encode('utf-8')
+            ).hexdigest()
+        return self._index_hash
+    
+    def save_references(self):
+        """Sauvegarde le DataFrame dans le fichier Parquet"""
+        df = self.df
+        # Parquet impose un type par colonne (l'Excel d'origine peut en mélanger)
+        def to_text(v):
+            if not isinstance(v, str) and pd.isna(v):
+                return None
+            if isinstance(v, float) and v.is_integer():
+                v = int(v)
+            return str(v)
+        
+        for col in ('Références Prozon', 'Noms des produits', 'Références EHS'):
+            df[col] = df[col].map(to_text)
+        for col in ('Prix', 'poids'):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        df.to_parquet(self.references_path, index=False)
+        self._mtime = os.stat(self.references_path).st_mtime_ns
+        print(f"💾 Références sauvegardées : {self.references_path}")
+    
+    def is_stale(self) -> bool:
+        """Vrai si le fichier de références a été modifié par un autre processus"""
+        try:
+            return os.stat(self.references_path).st_mtime_ns != self._mtime
         except FileNotFoundError:
-            # Créer un fichier Excel vide si inexistant
-            self.df = pd.DataFrame(columns=[
-                'Références Prozon',
-                'Noms des produits',
-                'Références EHS',
-                'Prix',
-                'poids'
-            ])
-            self.excel_path = excel_path
-            self.save_excel()
-            print(f"✅ Fichier Excel créé : {excel_path}")
-    
-    def save_excel(self):
-        """Sauvegarde le DataFrame dans le fichier Excel"""
-        self.df.to_excel(self.excel_path, index=False)
-        print(f"💾 Fichier Excel sauvegardé : {self.excel_path}")
+            return True
+    
+    def export_to_xlsx(self, output_path: str):
+        """Exporte les références vers un fichier Excel (openpyxl en écriture seule)"""
+        df = self.df
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False, name=None):
+            ws.append([None if pd.isna(v) else v for v in row])
+        wb.save(output_path)
     
     def add_or_update_reference(self, ref_prozon: str, ref_ehs: str, 
-                                nom_produit: str, poids: float, prix: float = None):
-        """Ajoute ou met à jour une référence"""
-        # Vérifier si la référence existe déjà
-        existing = self.df[self.df['Références Prozon'] == ref_prozon]
+                                nom_produit: str, poids: float, prix: float = None,
+                                save: bool = True):
+        """Ajoute ou met à jour une référence
         
-        if not existing.empty:
-            # Mettre à jour
-            idx = existing.index[0]
-            self.df.at[idx, 'Références EHS'] = ref_ehs
-            self.df.at[idx, 'Noms des produits'] = nom_produit
-            self.df.at[idx, 'poids'] = poids
-            if prix:
-                self.df.at[idx, 'Prix'] = prix
+        save=False permet d'enchaîner plusieurs ajouts et de sauvegarder une seule fois
+        """
+        if ref_prozon in self._index:
+            # Mettre à jour (ligne en attente ou ligne du DataFrame, sans parcours)
+            pending = self._pending_pos.get(ref_prozon)
+            if pending is not None:
+                row = self._pending_rows[pending]
+                row['Références EHS'] = ref_ehs
+                row['Noms des produits'] = nom_produit
+                row['poids'] = poids
+                if prix:
+                    row['Prix'] = prix
+                prix_actuel = row['Prix']
+            else:
+                df = self._base_df()
+                idx = self._row_position(ref_prozon)
+                df.at[idx, 'Références EHS'] = ref_ehs
+                df.at[idx, 'Noms des produits'] = nom_produit
+                df.at[idx, 'poids'] = poids
+                if prix:
+                    df.at[idx, 'Prix'] = prix
+                prix_actuel = df.at[idx, 'Prix']
+            self._index[ref_prozon][0] = self._index_entry(
+                ref_ehs, nom_produit, poids, prix_actuel
+            )
             action = "mise à jour"
         else:
-            # Ajouter
-            new_row = pd.DataFrame({
-                'Références Prozon': [ref_prozon],
-                'Noms des produits': [nom_produit],
-                'Références EHS': [ref_ehs],
-                'Prix': [prix if prix else ''],
-                'poids': [poids]
+            # Ajouter (intégré au DataFrame au prochain accès)
+            self._pending_pos[ref_prozon] = len(self._pending_rows)
+            self._pending_rows.append({
+                'Références Prozon': ref_prozon,
+                'Noms des produits': nom_produit,
+                'Références EHS': ref_ehs,
+                'Prix': prix if prix else None,
+                'poids': poids
             })
-            self.df = pd.concat([self.df, new_row], ignore_index=True)
+            self._index[ref_prozon] = [
+                self._index_entry(ref_ehs, nom_produit, poids, prix if prix else None)
+            ]
             action = "ajout"
         
-        self.save_excel()
+        self._index_changed()
+        self._records_cache = None
+        if save:
+            self.save_references()
         return action
     
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extrait le texte brut d'un PDF"""
-        text = ""
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text()
-        return text
+    def extract_text_from_pdf(self, pdf: Union[str, bytes]) -> str:
+        """Extrait le texte brut d'un PDF (chemin ou contenu déjà lu)"""
+        return _submit_extraction(pdf).result()
     
     def parse_order(self, pdf_text: str) -> Dict:
         """Parse le texte du PDF pour extraire les informations structurées"""
@@ -100,43 +383,37 @@ class ProzonOrderProcessor:
         }
         
         # Extraire le numéro de commande
-        num_match = re.search(r'#(LI\d+)', pdf_text)
+        num_match = _RE_NUM.search(pdf_text)
         if num_match:
             order['numero_commande'] = num_match.group(1)
         
         # Extraire la référence de commande
-        ref_match = re.search(r'Réf\. de commande.*?\n\s*(\w+)', pdf_text)
+        ref_match = _RE_REF.search(pdf_text)
         if ref_match:
             order['ref_commande'] = ref_match.group(1)
         
         # Extraire la date
-        date_match = re.search(r'LIVRAISON\s+(\d{2}/\d{2}/\d{4})', pdf_text)
+        date_match = _RE_DATE.search(pdf_text)
         if date_match:
             order['date'] = date_match.group(1)
         
         # Extraire l'adresse de livraison
-        adresse_section = re.search(
-            r'Adresse de livraison\s+(.*?)(?=Réf\. de commande|$)', 
-            pdf_text, 
-            re.DOTALL
-        )
+        # (les regex DOTALL ne sont lancées qu'à partir de leur ancre, si elle existe)
+        i = pdf_text.find('Adresse de livraison')
+        adresse_section = _RE_ADDR.search(pdf_text, i) if i >= 0 else None
         if adresse_section:
             adresse_text = adresse_section.group(1).strip()
             lines = [l.strip() for l in adresse_text.split('\n') if l.strip()]
             
-            # Extraire tous les numéros de téléphone (format français)
-            telephone_pattern = r'0\d{9}'
-            telephones = []
-            for line in lines:
-                phone_matches = re.findall(telephone_pattern, line)
-                telephones.extend(phone_matches)
+            # Extraire tous les numéros de téléphone (format français), en une passe
+            telephones = _RE_PHONE.findall(adresse_text)
             
-            # Filtrer les lignes sans téléphone pour construire l'adresse
-            adresse_lines = []
-            for line in lines:
-                # Garder la ligne si elle ne contient pas QUE des chiffres ou "France"
-                if not re.match(r'^0\d{9}$', line) and line.lower() != 'france':
-                    adresse_lines.append(line)
+            # Filtrer les lignes sans téléphone pour construire l'adresse :
+            # garder la ligne si elle ne contient pas QUE des chiffres ou "France"
+            adresse_lines = [
+                line for line in lines
+                if not _RE_PHONE_ONLY.match(line) and line.lower() != 'france'
+            ]
             
             # Construction intelligente de l'adresse
             nom_complet = ''
@@ -165,22 +442,28 @@ class ProzonOrderProcessor:
             }
         
         # Extraire les produits
-        produits_section = re.search(
-            r'Référence\s+Produit\s+Qté\s+(.*?)(?=Le destinataire|$)', 
-            pdf_text, 
-            re.DOTALL
-        )
+        i = pdf_text.find('Référence')
+        produits_section = _RE_ORDER_ITEMS.search(pdf_text, i) if i >= 0 else None
         
         if produits_section:
-            produits_text = produits_section.group(1)
-            ref_pattern = r'(\d{5}-\d+)\s+(.*?)(?=\d{5}-\d+|Le destinataire|$)'
-            matches = re.finditer(ref_pattern, produits_text, re.DOTALL)
+            # Lecture ligne à ligne, en une passe : une ligne commençant par une référence
+            # ouvre un produit, les lignes suivantes complètent sa description
+            items = []
+            for line in produits_section.group('body').split('\n'):
+                # Le texte PDF contient souvent des blancs en début de ligne
+                line = line.lstrip()
+                if line.startswith('Le destinataire'):
+                    break
+                item_match = _RE_ITEM_LINE.match(line)
+                if item_match:
+                    items.append((item_match.group(1), [item_match.group(2) or '']))
+                elif items:
+                    items[-1][1].append(line)
             
-            for match in matches:
-                ref_prozon = match.group(1)
-                description_full = match.group(2).strip()
+            for ref_prozon, description_lines in items:
+                description_full = '\n'.join(description_lines).strip()
                 
-                qte_match = re.search(r'(\d+)\s*$', description_full)
+                qte_match = _RE_QTY.search(description_full)
                 
                 if qte_match:
                     qte = int(qte_match.group(1))
@@ -201,25 +484,84 @@ class ProzonOrderProcessor:
     
     def convert_reference(self, ref_prozon: str) -> List[Dict]:
         """Convertit une référence Prozon en référence(s) EHS avec poids"""
-        matches = self.df[self.df['Références Prozon'] == ref_prozon]
+        return self._index.get(ref_prozon, [])
+    
+    def process_pdf(self, pdf_path: str) -> Dict:
+        """Traite un PDF complet et enrichit avec les correspondances
         
-        if matches.empty:
-            return []
+        Les derniers résultats sont gardés en mémoire (LRU de _MEMO_MAX_RESULTS) et,
+        si cache_dir est défini, sur disque.
+        """
+        pdf_bytes = self._read_pdf(pdf_path)
+        key, order = self._lookup(pdf_bytes)
+        if order is None:
+            order = self._build_order(self.extract_text_from_pdf(pdf_bytes))
+            self._store(key, order)
+        # Copie : l'appelant peut modifier la commande sans altérer le cache
+        return copy.deepcopy(order)
+    
+    def process_pdfs(self, pdf_paths: List[str]) -> List[Optional[Dict]]:
+        """Traite un lot de PDFs (None pour ceux en erreur, ordre conservé)
         
-        results = []
-        for _, row in matches.iterrows():
-            results.append({
-                'reference_ehs': row['Références EHS'],
-                'nom_produit': row['Noms des produits'],
-                'poids_unitaire': row['poids'] if pd.notna(row['poids']) else None,
-                'prix': row['Prix'] if pd.notna(row['Prix']) else None
-            })
+        Les extractions de texte manquant au cache sont lancées en parallèle dans le
+        pool de processus ; parsing et enrichissement restent dans ce processus.
+        """
+        results: List[Optional[Dict]] = [None] * len(pdf_paths)
+        pending = []  # (position, clé, extraction en cours)
+        for i, pdf_path in enumerate(pdf_paths):
+            try:
+                pdf_bytes = self._read_pdf(pdf_path)
+                key, order = self._lookup(pdf_bytes)
+                if order is None:
+                    pending.append((i, key, _submit_extraction(pdf_bytes)))
+                else:
+                    results[i] = copy.deepcopy(order)
+            except Exception as e:
+                print(f"Erreur traitement {pdf_path}: {e}")
         
+        for i, key, future in pending:
+            try:
+                order = self._build_order(future.result())
+                self._store(key, order)
+                results[i] = copy.deepcopy(order)
+            except Exception as e:
+                print(f"Erreur traitement {pdf_paths[i]}: {e}")
         return results
     
-    def process_pdf(self, pdf_path: str) -> Dict:
-        """Traite un PDF complet et enrichit avec les correspondances"""
-        text = self.extract_text_from_pdf(pdf_path)
+    @staticmethod
+    def _read_pdf(pdf_path: str) -> bytes:
+        # Le fichier n'est lu qu'une fois : pour la clé de cache puis pour PDFium
+        with open(pdf_path, 'rb', buffering=1 << 20) as f:
+            return f.read()
+    
+    def _lookup(self, pdf_bytes: bytes):
+        """Clé de cache d'un PDF et résultat déjà connu (mémoire puis disque), sinon None"""
+        key = self._cache_key(pdf_bytes)
+        with self._results_lock:
+            order = self._results.get(key)
+            if order is not None:
+                self._results.move_to_end(key)
+                return key, order
+        if self.cache_dir:
+            order = self._read_cache(os.path.join(self.cache_dir, f"{key}.json"))
+            if order is not None:
+                self._remember(key, order)
+        return key, order
+    
+    def _store(self, key: str, order: Dict):
+        """Enregistre un résultat calculé (disque si cache_dir, et mémoire)"""
+        if self.cache_dir:
+            self._write_cache(os.path.join(self.cache_dir, f"{key}.json"), order)
+        self._remember(key, order)
+    
+    def _remember(self, key: str, order: Dict):
+        with self._results_lock:
+            self._results[key] = order
+            while len(self._results) > _MEMO_MAX_RESULTS:
+                self._results.popitem(last=False)
+    
+    def _build_order(self, text: str) -> Dict:
+        """Parsing et enrichissement d'un texte de PDF (sans cache)"""
         order = self.parse_order(text)
         
         # Enrichissement avec les correspondances EHS
@@ -251,32 +593,96 @@ class ProzonOrderProcessor:
         order['produits'] = produits_expanded
         return order
     
-    def export_to_csv(self, orders: List[Dict], output_path: str):
-        """Exporte les commandes vers un CSV"""
-        rows = []
-        
-        for order in orders:
-            for prod in order['produits']:
-                row = {
-                    'Numero_Commande': order['numero_commande'],
-                    'Ref_Commande': order['ref_commande'],
-                    'Date': order['date'],
-                    'Client': order['adresse']['nom_complet'],
-                    'Adresse_Livraison': order['adresse']['rue'],
-                    'Ville': order['adresse']['ville'],
-                    'Telephone': order['adresse']['telephone'],
-                    'Ref_Prozon': prod['reference_prozon'],
-                    'Ref_EHS': prod.get('reference_ehs', 'NON_TROUVEE'),
-                    'Quantite': prod['quantite'],
-                    'Poids_Unitaire': prod.get('poids_unitaire', ''),
-                    'Poids_Total': prod.get('poids_total', ''),
-                    'Statut': prod['statut']
-                }
-                rows.append(row)
-        
-        df_export = pd.DataFrame(rows)
-        df_export.to_csv(output_path, index=False, encoding='utf-8-sig')
-        return df_export
+    def _cache_key(self, pdf_bytes: bytes) -> str:
+        """Clé de cache d'un PDF (contenu du PDF + état des correspondances)"""
+        h = hashlib.sha256(pdf_bytes)
+        h.update(f"{_CACHE_VERSION}:{self.index_hash}".encode('ascii'))
+        return h.hexdigest()
+    
+    def _read_cache(self, cache_path: str) -> Optional[Dict]:
+        """Lit un résultat du cache disque (None si absent ou illisible)"""
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                order = json.load(f)
+            if not isinstance(order, dict):
+                raise ValueError("contenu inattendu")
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            # Fichier tronqué ou corrompu : traité comme absent, et supprimé pour être réécrit
+            print(f"Cache illisible {cache_path}: {e}")
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+            return None
+        # Date d'accès mise à jour : le nettoyage supprime les moins récemment utilisés
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return order
+    
+    def _write_cache(self, cache_path: str, order: Dict):
+        """Écrit le résultat d'un PDF dans le cache (écriture atomique)"""
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.cache_dir,
+                                         suffix='.tmp', delete=False) as f:
+            try:
+                json.dump(order, f, ensure_ascii=False)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, cache_path)
+        self._prune_cache()
+    
+    def _prune_cache(self):
+        """Limite le cache disque à _CACHE_MAX_FILES résultats (les plus anciens sont supprimés)"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    try:
+                        entries.append((entry.stat().st_mtime_ns, entry.path))
+                    except FileNotFoundError:
+                        pass
+        if len(entries) <= _CACHE_MAX_FILES:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - _CACHE_MAX_FILES]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # déjà supprimé par un autre thread / worker
+    
+    def export_to_csv(self, orders: List[Dict], output_path: str) -> int:
+        """Exporte les commandes vers un CSV (écriture ligne par ligne)"""
+        count = 0
+        with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.CSV_FIELDS)
+            for order in orders:
+                # Colonnes communes à toutes les lignes de la commande
+                adr = order['adresse']
+                base = (order['numero_commande'], order['ref_commande'], order['date'],
+                        adr['nom_complet'], adr['rue'], adr['ville'], adr['telephone'])
+                produits = order['produits']
+                writer.writerows(
+                    base + (prod['reference_prozon'], prod.get('reference_ehs', 'NON_TROUVEE'),
+                            prod['quantite'], prod.get('poids_unitaire', ''),
+                            prod.get('poids_total', ''), prod['statut'])
+                    for prod in produits
+                )
+                count += len(produits)
+        return count
+
+
+def ojsonify(obj):
+    """Équivalent de jsonify, sérialisé avec orjson (plus rapide pour les grosses réponses)"""
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype='application/json'
+    )
 
 
 # Instance globale du processeur
@@ -284,11 +690,22 @@ processor = None
 
 def get_processor():
     global processor
-    if processor is None:
-        processor = ProzonOrderProcessor(app.config['EXCEL_FILE'])
+    # Rechargement si un autre worker a modifié les références
+    if processor is None or processor.is_stale():
+        processor = ProzonOrderProcessor(
+            app.config['REFERENCES_FILE'],
+            cache_dir=os.path.join(app.config['OUTPUT_FOLDER'], '.cache'),
+            excel_path=app.config['EXCEL_FILE']
+        )
     return processor
 
 
+# Chargement anticipé des références : avec `gunicorn --preload`, il est fait une seule
+# fois avant le fork et partagé par tous les workers (pas dans les processus d'extraction)
+if not app.config.get('TESTING') and multiprocessing.parent_process() is None:
+    get_processor()
+
+
 @app.route('/')
 def index():
     """Page d'accueil"""
@@ -299,36 +716,29 @@ def index():
 def references():
     """Page de gestion des références"""
     proc = get_processor()
-    references_list = proc.df.to_dict('records')
-    return render_template('references.html', references=references_list)
+    return render_template('references.html', references=proc.records())
 
 
 @app.route('/api/references', methods=['GET'])
 def get_references():
     """API : Récupérer toutes les références"""
     proc = get_processor()
-    return jsonify(proc.df.to_dict('records'))
+    return ojsonify(proc.records())
 
 
 @app.route('/api/references/add', methods=['POST'])
 def add_reference():
     """API : Ajouter ou modifier une référence"""
-    data = request.json
     proc = get_processor()
     
     try:
-        action = proc.add_or_update_reference(
-            ref_prozon=data['ref_prozon'],
-            ref_ehs=data['ref_ehs'],
-            nom_produit=data['nom_produit'],
-            poids=float(data['poids']),
-            prix=float(data.get('prix', 0)) if data.get('prix') else None
-        )
+        payload = RefPayload(**(request.get_json() or {}))
+        action = proc.add_or_update_reference(**asdict(payload))
         
         return jsonify({
             'success': True,
             'action': action,
-            'message': f'Référence {data["ref_prozon"]} {action} avec succès'
+            'message': f'Référence {payload.ref_prozon} {action} avec succès'
         })
     except Exception as e:
         return jsonify({
@@ -337,6 +747,15 @@ def add_reference():
         }), 400
 
 
+@app.route('/api/references/export_xlsx')
+def export_references_xlsx():
+    """API : Exporter les références au format Excel"""
+    proc = get_processor()
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], 'Produits_référencés_EHS.xlsx')
+    proc.export_to_xlsx(output_path)
+    return send_file(os.path.abspath(output_path), as_attachment=True)
+
+
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
     """API : Upload de PDFs"""
@@ -371,15 +790,11 @@ def process_orders():
     if not pdf_files:
         return jsonify({'error': 'Aucun PDF à traiter'}), 400
     
-    orders = []
-    for pdf_file in pdf_files:
-        try:
-            order = proc.process_pdf(str(pdf_file))
-            orders.append(order)
-        except Exception as e:
-            print(f"Erreur traitement {pdf_file}: {e}")
+    # Extraction du texte en parallèle (processus séparés), ordre des résultats conservé
+    results = proc.process_pdfs([str(pdf_file) for pdf_file in pdf_files])
+    orders = [order for order in results if order is not None]
     
-    return jsonify({
+    return ojsonify({
         'success': True,
         'orders': orders,
         'count': len(orders)
@@ -420,17 +835,13 @@ def download_file(filename):
 
 
 if __name__ == '__main__':
-    # Vérifier si le fichier Excel existe, sinon le créer
-    if not os.path.exists(app.config['EXCEL_FILE']):
-        print("Création du fichier Excel...")
-        proc = ProzonOrderProcessor(app.config['EXCEL_FILE'])
-    
+    # Serveur de développement ; en production : gunicorn -w 4 --preload app:app
     print("\n" + "="*80)
     print("🚀 APPLICATION PROZON - DÉMARRÉE")
     print("="*80)
     print(f"\n📂 Dossier uploads: {app.config['UPLOAD_FOLDER']}")
     print(f"📂 Dossier outputs: {app.config['OUTPUT_FOLDER']}")
-    print(f"📊 Fichier Excel: {app.config['EXCEL_FILE']}")
+    print(f"📊 Fichier références: {app.config['REFERENCES_FILE']}")
     print(f"\n🌐 Ouvrir dans votre navigateur:")
     print(f"   → http://localhost:5000")
     print("\n" + "="*80 + "\n")